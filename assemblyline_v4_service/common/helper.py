@@ -1,6 +1,13 @@
+import functools
 import os
 import yaml
 
+try:
+    # libyaml's C parser when available, several times faster than the Python one
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 from io import BytesIO
 from typing import Dict, Union
 
@@ -32,7 +39,10 @@ def get_classification() -> Classification:
     return Classification(classification_definition)
 
 
-def get_heuristics() -> Dict[Union[str, int], Heuristic]:
+@functools.lru_cache(maxsize=4)
+def _cached_heuristics(manifest_path: str, manifest_mtime: float) -> Dict[Union[str, int], Heuristic]:
+    # The manifest path and mtime only key the cache; the manifest itself is
+    # re-resolved and re-read by get_service_manifest on a miss.
     service_manifest_data = get_service_manifest()
     output = {}
     heuristics = service_manifest_data.get('heuristics', None)
@@ -48,6 +58,15 @@ def get_heuristics() -> Dict[Union[str, int], Heuristic]:
     return output
 
 
+def get_heuristics() -> Dict[Union[str, int], Heuristic]:
+    manifest_path = get_service_manifest_path()
+    try:
+        manifest_mtime = os.stat(manifest_path).st_mtime
+    except FileNotFoundError:
+        manifest_mtime = 0.0
+    return _cached_heuristics(manifest_path, manifest_mtime)
+
+
 def get_service_attributes() -> Service:
     service_manifest_data = get_service_manifest()
 
@@ -63,11 +82,16 @@ def get_service_attributes() -> Service:
     return service_attributes
 
 
-def get_service_manifest() -> Dict:
+def get_service_manifest_path() -> str:
     service_manifest_yml = os.environ.get(
         'SERVICE_MANIFEST_PATH', f"/tmp/{os.environ.get('RUNTIME_PREFIX', 'service')}_manifest.yml")
     if not os.path.exists(service_manifest_yml):
         service_manifest_yml = os.path.join(os.getcwd(), os.environ.get('MANIFEST_FOLDER', ''), 'service_manifest.yml')
+    return service_manifest_yml
+
+
+def get_service_manifest() -> Dict:
+    service_manifest_yml = get_service_manifest_path()
 
     if os.path.exists(service_manifest_yml):
         bio = BytesIO()
@@ -77,7 +101,7 @@ def get_service_manifest() -> Dict:
             bio.flush()
         bio.seek(0)
 
-        yml_data = yaml.safe_load(bio)
+        yml_data = yaml.load(bio, Loader=YamlLoader)
         if yml_data:
             # Ignore stable from service version
             yml_data['version'] = yml_data.get('version', SERVICE_TAG).replace('stable', '')
@@ -1,18 +1,28 @@
 import argparse
-import json
+import errno
+import fcntl
+import hashlib
 import logging
 import os
-import pprint
 import shutil
+import stat
 import tempfile
 import yaml
 import cProfile
 
+import orjson
+
+try:
+    # libyaml's C parser when available, several times faster than the Python one
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 from cart import unpack_stream
 from typing import Union, Dict
 
 from assemblyline.common import forge
-from assemblyline.common.heuristics import HeuristicHandler, InvalidHeuristicException
+from assemblyline.common.heuristics import HeuristicHandler
 from assemblyline.common.importing import load_module_by_path
 from assemblyline.common.isotime import now_as_iso
 from assemblyline.common.uid import get_random_id
@@ -22,6 +32,81 @@ from assemblyline.odm.models.service import Service
 from assemblyline_v4_service.common.helper import get_heuristics
 
 
+# ioctl request to clone a file (reflink) on filesystems that support it (btrfs/xfs)
+FICLONE = 0x40049409
+
+
+class _HashingWriter:
+    """File-like wrapper that keeps a running sha256 of everything written."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.fh.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def _stage(src, dst):
+    """Stage src at dst without copying bytes when possible.
+
+    Tries a hardlink first (zero-byte metadata op), then a reflink clone,
+    and only falls back to a full byte copy when neither is available.
+    """
+    if os.path.exists(dst):
+        # Same file (or an earlier hardlink of it): the input is already staged,
+        # never unlink it out from under the caller.
+        if os.path.samefile(src, dst):
+            return
+        os.unlink(dst)
+
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+
+    try:
+        with open(src, 'rb') as src_fh, open(dst, 'wb') as dst_fh:
+            fcntl.ioctl(dst_fh.fileno(), FICLONE, src_fh.fileno())
+        return
+    except OSError:
+        # Only clean up a destination the failed clone attempt actually created
+        if os.path.exists(dst):
+            os.unlink(dst)
+
+    shutil.copyfile(src, dst)
+
+
+def _stat_or_none(path):
+    # Any stat failure counts as "not there", matching os.path.exists/isfile
+    # semantics (e.g. NotADirectoryError for a file used as a path component)
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _hash_file(path):
+    """Compute md5, sha1, sha256 and size in a single pass over the file."""
+    md5, sha1, sha256 = hashlib.md5(), hashlib.sha1(), hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            md5.update(chunk)
+            sha1.update(chunk)
+            sha256.update(chunk)
+    return {'md5': md5.hexdigest(), 'sha1': sha1.hexdigest(), 'sha256': sha256.hexdigest(), 'size': size}
+
+
 class RunService:
     def __init__(self):
         self.service = None
@@ -30,6 +115,18 @@ class RunService:
         self.file_dir = None
         self.identify = forge.get_identify(use_cache=False)
 
+    def _fileinfo(self, path):
+        # Have identify skip its own hashing (one read of the file per digest) and
+        # feed each chunk to all three hashers in a single pass instead. Identify
+        # versions that cannot skip hashing just do the work themselves.
+        try:
+            file_info = self.identify.fileinfo(path, generate_hashes=False)
+        except TypeError:
+            return self.identify.fileinfo(path)
+
+        file_info.update(_hash_file(path))
+        return file_info
+
     def try_run(self):
         try:
             self.service_class = load_module_by_path(SERVICE_PATH)
@@ -41,36 +138,44 @@ class RunService:
 
         self.load_service_manifest()
 
-        if not os.path.isfile(FILE_PATH):
-            LOG.info(f"File not found: {FILE_PATH}")
+        file_st = _stat_or_none(FILE_PATH)
+        if file_st is None or not stat.S_ISREG(file_st.st_mode):
+            LOG.info("File not found: %s", FILE_PATH)
             return
 
         self.file_dir = os.path.dirname(FILE_PATH)
 
-        # Get filename and working dir
+        # Get filename, temp dir and working dir
         file_name = os.path.basename(FILE_PATH)
-        working_dir = os.path.join(self.file_dir, f'{os.path.basename(FILE_PATH)}_{SERVICE_NAME.lower()}')
+        tmpdir = tempfile.gettempdir()
+        working_dir = os.path.join(self.file_dir, f'{file_name}_{SERVICE_NAME.lower()}')
 
         # Start service
         self.service.start_service()
 
         # Identify the file
-        file_info = self.identify.fileinfo(FILE_PATH)
+        file_info = self._fileinfo(FILE_PATH)
         if file_info['type'] == "archive/cart" or file_info['magic'] == "custom: archive/cart":
-            # This is a CART file, uncart it and recreate the file info object
-            original_temp = os.path.join(tempfile.gettempdir(), file_info['sha256'])
-            with open(FILE_PATH, 'rb') as ifile, open(original_temp, 'wb') as ofile:
-                unpack_stream(ifile, ofile)
-
-            file_info = self.identify.fileinfo(original_temp)
-            target_file = os.path.join(tempfile.gettempdir(), file_info['sha256'])
-            shutil.move(original_temp, target_file)
-            LOG.info(f"File was a CaRT archive, it was un-CaRTed to {target_file} for processing")
+            # This is a CART file, uncart it and recreate the file info object.
+            # The sha256 of the payload is computed while it is written out so we
+            # can name the file directly instead of re-reading it to find out.
+            with open(FILE_PATH, 'rb') as ifile, \
+                    tempfile.NamedTemporaryFile(dir=tmpdir, delete=False) as ofile:
+                writer = _HashingWriter(ofile)
+                unpack_stream(ifile, writer)
+                original_temp = ofile.name
+
+            digest = writer.hexdigest()
+            target_file = os.path.join(tmpdir, digest)
+            os.replace(original_temp, target_file)
+            file_info = self._fileinfo(target_file)
+            file_info['sha256'] = digest
+            LOG.info("File was a CaRT archive, it was un-CaRTed to %s for processing", target_file)
 
         else:
-            # It not a cart, move the file to the right place to be processed
-            target_file = os.path.join(tempfile.gettempdir(), file_info['sha256'])
-            shutil.copyfile(FILE_PATH, target_file)
+            # It not a cart, stage the file in the right place to be processed
+            target_file = os.path.join(tmpdir, file_info['sha256'])
+            _stage(FILE_PATH, target_file)
 
         if SUBMISSION_PARAMS:
             for kv in SUBMISSION_PARAMS:
@@ -100,66 +205,82 @@ class RunService:
             ttl=3600
         ))
 
-        LOG.info(f"Starting task with SID: {service_task.sid}")
+        LOG.info("Starting task with SID: %s", service_task.sid)
 
         # Set the working directory to a directory with same parent as input file
-        if os.path.isdir(working_dir):
+        working_st = _stat_or_none(working_dir)
+        if working_st is not None and stat.S_ISDIR(working_st.st_mode):
             shutil.rmtree(working_dir)
-        if not os.path.isdir(working_dir):
-            os.makedirs(os.path.join(working_dir, 'working_directory'))
+        os.makedirs(working_dir, exist_ok=True)
 
         self.service.handle_task(service_task)
 
         # Move the result.json and extracted/supplementary files to the working directory
-        source = os.path.join(tempfile.gettempdir(), 'working_directory')
-        if not os.path.exists(source):
+        source = os.path.join(tmpdir, 'working_directory')
+        if _stat_or_none(source) is None:
             os.makedirs(source)
 
-        files = os.listdir(source)
-        for f in files:
-            shutil.move(os.path.join(source, f), os.path.join(working_dir, 'working_directory'))
-
-        # Cleanup files from the original directory created by the service base
-        shutil.rmtree(source)
-
-        result_json = os.path.join(tempfile.gettempdir(),
+        dest = os.path.join(working_dir, 'working_directory')
+        try:
+            # Rename the whole directory into place: a single syscall no matter how
+            # many files the service extracted, as long as both sides share a filesystem.
+            os.replace(source, dest)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            os.makedirs(dest, exist_ok=True)
+            with os.scandir(source) as it:
+                for entry in it:
+                    shutil.move(entry.path, os.path.join(dest, entry.name))
+
+            # Cleanup files from the original directory created by the service base
+            shutil.rmtree(source)
+
+        result_json = os.path.join(tmpdir,
                                    f'{service_task.sid}_{service_task.fileinfo.sha256}_result.json')
 
-        if not os.path.exists(result_json):
+        if _stat_or_none(result_json) is None:
             raise Exception("A service error occured and no result json was found.")
 
         # Validate the generated result
-        with open(result_json, 'r') as fh:
+        result = None
+        with open(result_json, 'rb') as fh:
             try:
-                result = json.load(fh)
+                result = orjson.loads(fh.read())
                 result.pop('temp_submission_data', None)
                 for file in result['response']['extracted'] + result['response']['supplementary']:
                     file.pop('path', None)
 
-                # Load heuristics
+                # Load heuristics (cached in common.helper on the manifest path and mtime)
                 heuristics = get_heuristics()
 
-                # Transform heuristics and calculate score
+                # Transform heuristics and calculate score. The handler is hoisted out
+                # of the loop and unknown heuristic IDs are filtered up front instead
+                # of being caught as exceptions inside the loop.
+                heuristic_handler = HeuristicHandler()
                 total_score = 0
                 for section in result['result']['sections']:
                     # Ignore tag and sig safe flags since we have no connection to the safelist
                     section.pop('zeroize_on_tag_safe', None)
                     section.pop('zeroize_on_sig_safe', None)
 
-                    if section['heuristic']:
-                        heur_id = section['heuristic']['heur_id']
-
-                        try:
-                            section['heuristic'], new_tags = HeuristicHandler().service_heuristic_to_result_heuristic(
-                                section['heuristic'], heuristics)
-                            for tag in new_tags:
-                                section['tags'].setdefault(tag[0], [])
-                                if tag[1] not in section['tags'][tag[0]]:
-                                    section['tags'][tag[0]].append(tag[1])
-                            total_score += section['heuristic']['score']
-                        except InvalidHeuristicException:
-                            section['heuristic'] = None
-                        section['heuristic']['name'] = heuristics[heur_id]['name']
+                    if not section['heuristic']:
+                        continue
+
+                    heur = heuristics.get(section['heuristic']['heur_id'])
+                    if heur is None:
+                        section['heuristic'] = None
+                        continue
+
+                    transformed, new_tags = heuristic_handler.service_heuristic_to_result_heuristic(
+                        section['heuristic'], heuristics)
+                    for tag in new_tags:
+                        section['tags'].setdefault(tag[0], [])
+                        if tag[1] not in section['tags'][tag[0]]:
+                            section['tags'][tag[0]].append(tag[1])
+                    transformed['name'] = heur['name']
+                    section['heuristic'] = transformed
+                    total_score += transformed['score']
                 result['result']['score'] = total_score
 
                 # Add timestamps for creation, archive and expiry
@@ -167,23 +288,34 @@ class RunService:
                 result['archive_ts'] = None
                 result['expiry_ts'] = now_as_iso(service_task.ttl * 24 * 60 * 60)
 
-                result = Result(result)
-
-                # Print the result on console if in debug mode
-                if args.debug:
-                    f"{SERVICE_NAME.upper()}-RESULT".center(60, '-')
-                    for line in pprint.pformat(result.result.as_primitives()).split('\n'):
+                # Print the result on console if in debug mode. Re-validating through
+                # the ODM is only needed for that printout, skip it otherwise.
+                if args.debug and LOG.isEnabledFor(logging.DEBUG):
+                    out = orjson.dumps(Result(result).result.as_primitives(),
+                                       option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode()
+                    for line in out.splitlines():
                         LOG.debug(line)
             except Exception as e:
-                LOG.error(f"Invalid result created: {str(e)}")
-
-        LOG.info(f"Cleaning up file used for temporary processing: {target_file}")
-        os.unlink(target_file)
-
-        LOG.info(f"Moving {result_json} to the working directory: {working_dir}/result.json")
-        shutil.move(result_json, os.path.join(working_dir, 'result.json'))
+                LOG.error("Invalid result created: %s", str(e))
+                result = None
+
+        # The staged copy is only removed when it is a separate path from the input;
+        # when FILE_PATH already sat at its target, unlinking would delete the sample.
+        if os.path.abspath(FILE_PATH) != os.path.abspath(target_file):
+            LOG.info("Cleaning up file used for temporary processing: %s", target_file)
+            os.unlink(target_file)
+
+        LOG.info("Moving %s to the working directory: %s/result.json", result_json, working_dir)
+        if result is not None:
+            # Write the post-processed result (heuristics resolved, score computed) so
+            # downstream consumers do not have to re-apply the transforms.
+            with open(os.path.join(working_dir, 'result.json'), 'wb') as fh:
+                fh.write(orjson.dumps(result))
+            os.unlink(result_json)
+        else:
+            shutil.move(result_json, os.path.join(working_dir, 'result.json'))
 
-        LOG.info(f"Successfully completed task. Output directory: {working_dir}")
+        LOG.info("Successfully completed task. Output directory: %s", working_dir)
 
     def stop(self):
         self.service.stop_service()
@@ -194,12 +326,13 @@ class RunService:
 
         if os.path.exists(service_manifest_yml):
             with open(service_manifest_yml) as yml_fh:
-                service_manifest_data = yaml.safe_load(yml_fh.read())
+                service_manifest_data = yaml.load(yml_fh, Loader=YamlLoader)
 
             heuristics = service_manifest_data.get('heuristics', None)
+            submission_params = service_manifest_data.get('submission_params') or ()
 
             # Pop the 'extra' data from the service manifest
-            for x in ['file_required', 'tool_version', 'heuristics']:
+            for x in ('file_required', 'tool_version', 'heuristics'):
                 service_manifest_data.pop(x, None)
 
             # Validate the service manifest
@@ -212,8 +345,7 @@ class RunService:
             if service_manifest_data:
                 service_config = service_manifest_data.get('config', {})
 
-            self.submission_params = {x['name']: x['default']
-                                      for x in service_manifest_data.get('submission_params', [])}
+            self.submission_params = {x['name']: x['default'] for x in submission_params}
 
             self.service = self.service_class(config=service_config)
             if return_heuristics:
@@ -1,7 +1,9 @@
+import hashlib
 import json
 import os
 import pytest
 import shutil
+import tempfile
 
 from pathlib import Path
 
@@ -73,8 +75,10 @@ class TestHelper:
         # Load identify
         self.identify = forge.get_identify(use_cache=False)
 
-        # Load submission params
-        self.submission_params = helper.get_service_attributes().submission_params
+        # Load service attributes (submission params and the version used to key cached results)
+        service_attributes = helper.get_service_attributes()
+        self.submission_params = service_attributes.submission_params
+        self.service_version = service_attributes.version
 
     def _create_service_task(self, file_path, params):
         fileinfo_keys = ["magic", "md5", "mime", "sha1", "sha256", "size", "type"]
@@ -198,7 +202,12 @@ class TestHelper:
         return generalized_results
 
     def _execute_sample(self, sample, save=False, save_files=False):
-        file_path = os.path.join("/tmp", sample.split('_', 1)[0])
+        # Unpack into a unique per-run directory: result folders for variants of the
+        # same sample (<sha> and <sha>_variant) share a cart, so concurrent workers
+        # would otherwise unpack onto and delete the same /tmp/<sha> file. The
+        # basename is kept as the bare sha256 so the task filename is unchanged.
+        unpack_dir = tempfile.mkdtemp(prefix='al_sample_')
+        file_path = os.path.join(unpack_dir, sample.split('_', 1)[0])
         cls = None
 
         try:
@@ -262,8 +271,8 @@ class TestHelper:
                 if os.path.exists(cls.working_directory):
                     shutil.rmtree(cls.working_directory)
                 cls._cleanup()
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if os.path.exists(unpack_dir):
+                shutil.rmtree(unpack_dir)
 
     def result_list(self):
         return [f for f in os.listdir(self.result_folder)
@@ -422,13 +431,57 @@ class TestHelper:
             if sha256 not in oh_map and name not in on_map:
                 ih.add_issue(f_type, ih.ACTION_ADDED, f"File '{name} [{sha256}]' added to the file list.")
 
+    def _load_params(self, sample):
+        params_file = os.path.join(self.result_folder, sample, 'params.json')
+        if os.path.exists(params_file):
+            return json.load(open(params_file))
+        return {}
+
+    def _result_cache_key(self, sample):
+        # The result folder name starts with the sample's sha256 so the file never
+        # needs to be re-hashed. The whole params.json is hashed since config,
+        # submission_params, metadata, temp_submission_data and tags all feed the task.
+        sample_sha256 = sample.split('_', 1)[0]
+        params_hash = hashlib.sha256(
+            json.dumps(self._load_params(sample), sort_keys=True).encode()).hexdigest()
+        return f"{sample_sha256}:{self.service_version}:{params_hash}"
+
+    def _load_result_index(self):
+        index_file = os.path.join(self.result_folder, '_index.json')
+        if os.path.exists(index_file):
+            return json.load(open(index_file))
+        return {}
+
+    def _save_result_index(self, index):
+        index_file = os.path.join(self.result_folder, '_index.json')
+        temp_file = f"{index_file}.{os.getpid()}.tmp"
+        json.dump(index, open(temp_file, 'w'), indent=2, sort_keys=True)
+        os.replace(temp_file, index_file)
+
+    def regenerate_sample(self, sample, save_files=False):
+        # Skip samples whose saved result was produced by the same service version
+        # and parameters; iterating on a service usually leaves most samples
+        # unchanged. Saving extracted/supplementary files always needs a full run,
+        # so the cache is bypassed entirely when save_files is set.
+        key = self._result_cache_key(sample)
+        result_json = os.path.join(self.result_folder, sample, 'result.json')
+        if not save_files and self._load_result_index().get(key) == result_json and os.path.exists(result_json):
+            print(f"Skipping {sample}, cached result is up to date")
+            return
+
+        print(f"Executing {sample}")
+        self._execute_sample(sample, save=True, save_files=save_files)
+
+        index = self._load_result_index()
+        index[key] = result_json
+        self._save_result_index(index)
+
     def regenerate_results(self, save_files=False, sample_sha256=""):
         for f in self.result_list():
             if sample_sha256 and f != sample_sha256:
                 print(f"{sample_sha256} requested. Skipping {f}...")
                 continue
             try:
-                print(f"Executing {f}")
-                self._execute_sample(f, save=True, save_files=save_files)
+                self.regenerate_sample(f, save_files=save_files)
             except FileMissing:
                 print(f"[W] File {f} was not found in any of the following locations: {', '.join(self.locations)}")
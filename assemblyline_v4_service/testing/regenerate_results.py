@@ -1,7 +1,10 @@
+import functools
 import os
 
+from concurrent.futures import ProcessPoolExecutor
+
 from assemblyline.common.importing import load_module_by_path
-from assemblyline_v4_service.testing.helper import TestHelper
+from assemblyline_v4_service.testing.helper import FileMissing, TestHelper
 
 required_env = [
     'SERVICE_MANIFEST_PATH',
@@ -15,6 +18,29 @@ optional_env = [
     'SERVICE_TESTING_SAVE_FILES'
 ]
 
+# Per-worker TestHelper, created once by _worker_init so each process loads the
+# service module a single time instead of once per sample.
+_worker_th = None
+
+
+def _make_helper():
+    return TestHelper(load_module_by_path(os.environ['SERVICE_PATH']),
+                      os.environ['SERVICE_TESTING_RESULT_FOLDER'],
+                      os.environ.get('SERVICE_TESTING_EXTRA_SAMPLE_FOLDER', None))
+
+
+def _worker_init():
+    global _worker_th
+    _worker_th = _make_helper()
+
+
+def _regenerate_one(sample, save_files=False):
+    try:
+        _worker_th.regenerate_sample(sample, save_files=save_files)
+    except FileMissing:
+        print(f"[W] File {sample} was not found in any of the following locations: "
+              f"{', '.join(_worker_th.locations)}")
+
 
 def run():
     for env in required_env:
@@ -26,11 +52,14 @@ def run():
         if os.environ.get(env, None) is None:
             print(f"[W] {env} environement variable is not set, it should probably be...")
 
-    th = TestHelper(load_module_by_path(os.environ['SERVICE_PATH']),
-                    os.environ['SERVICE_TESTING_RESULT_FOLDER'],
-                    os.environ.get('SERVICE_TESTING_EXTRA_SAMPLE_FOLDER', None))
+    th = _make_helper()
     save_files = os.environ.get('SERVICE_TESTING_SAVE_FILES', 'false').lower() == 'true'
-    th.regenerate_results(save_files=save_files)
+
+    # Each sample runs the service pipeline independently, so fan them out
+    # across one worker process per CPU.
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_worker_init) as executor:
+        list(executor.map(functools.partial(_regenerate_one, save_files=save_files),
+                          th.result_list(), chunksize=4))
 
 
 if __name__ == "__main__":
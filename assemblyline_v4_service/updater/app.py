@@ -1,13 +1,26 @@
 import functools
+import hmac
+import logging
 import os
+import stat
+import time
 
-import requests
-from flask import jsonify, make_response, request, send_from_directory, send_file, Flask
+import orjson
+import urllib3
+from flask import make_response, request, send_from_directory, send_file, stream_with_context, Flask, Response
 from werkzeug.exceptions import Unauthorized, ServiceUnavailable
 
-session = requests.session()
+# Pooled keep-alive connections to the updater daemon, without the per-call
+# object construction overhead of a full requests session.
+pool = urllib3.PoolManager(num_pools=1, maxsize=8)
+STATUS_URL = 'http://localhost:9999'
+
 app = Flask('service_updater')
+# When fronted by a reverse proxy configured for X-Sendfile/X-Accel-Redirect,
+# let the proxy serve file bytes with kernel sendfile instead of the worker.
+app.use_x_sendfile = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
 AUTH_KEY = os.environ.get('AL_INSTANCE_KEY', 'ThisIsARandomAuthKey...ChangeMe!')
+AUTH_KEY_BYTES = AUTH_KEY.encode()
 AL_ROOT_CA = os.environ.get('AL_ROOT_CA', '/etc/assemblyline/ssl/al_root-ca.crt')
 
 ssl_context = None
@@ -24,10 +37,11 @@ def container_ready():
 @app.route('/status')
 def update_status():
     """A report on readiness for services to run."""
-    request = session.get('http://localhost:9999')
-    request.raise_for_status()
+    status = pool.request('GET', STATUS_URL)
+    if status.status != 200:
+        raise ServiceUnavailable("Update status unavailable")
     response = app.response_class(
-        response=request.text,
+        response=status.data,
         status=200,
         mimetype='application/json'
     )
@@ -37,44 +51,84 @@ def update_status():
 def api_login(func):
     @functools.wraps(func)
     def base(*args, **kwargs):
-        # Before anything else, check that the API key is set
-        apikey = request.environ.get('HTTP_X_APIKEY', None)
-        if AUTH_KEY != apikey:
-            app.logger.warning(f'Client provided wrong api key [{apikey}]')
+        # Before anything else, check that the API key is set. compare_digest keeps
+        # the comparison constant-time so the key can't be probed byte by byte.
+        apikey = request.headers.get('X-Apikey', '')
+        if not hmac.compare_digest(apikey.encode(), AUTH_KEY_BYTES):
+            if app.logger.isEnabledFor(logging.WARNING):
+                app.logger.warning('Client provided wrong api key [%s]', apikey)
             raise Unauthorized("Unauthorized access denied")
         return func(*args, **kwargs)
 
     return base
 
 
+# Cached (path, tar) answer from the updater daemon, refreshed at most once per TTL
+# so download bursts don't serialize behind a localhost roundtrip per request.
+_PATHS_TTL = 1.0
+_paths_cache = {'expiry': 0.0, 'value': None}
+
+
 def get_paths():
+    if time.monotonic() < _paths_cache['expiry']:
+        return _paths_cache['value']
+
     try:
-        request = session.get('http://localhost:9999')
-        request.raise_for_status()
-        path = request.json()['_directory']
-        tar = request.json()['_tar']
-        if path is None or not os.path.isdir(path):
+        response = pool.request('GET', STATUS_URL)
+        if response.status != 200:
+            raise ValueError()
+        data = orjson.loads(response.data)
+        path = data['_directory']
+        tar = data['_tar']
+        if path is None or tar is None:
+            raise ValueError()
+        # One stat per path; os.stat raising FileNotFoundError lands in the except below
+        if not stat.S_ISDIR(os.stat(path).st_mode):
             raise ValueError()
-        if tar is None or not os.path.isfile(tar):
+        if not stat.S_ISREG(os.stat(tar).st_mode):
             raise ValueError()
     except Exception:
+        _paths_cache['expiry'] = 0.0
         raise ServiceUnavailable("No update ready")
+
+    _paths_cache['value'] = (path, tar)
+    _paths_cache['expiry'] = time.monotonic() + _PATHS_TTL
     return path, tar
 
 
+def _walk_files(path):
+    """Yield every file path under path without building the full list in memory."""
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    yield entry.path
+
+
+def _stream_file_listing(path):
+    yield b'{"files": ['
+    first = True
+    for file_path in _walk_files(path):
+        if first:
+            first = False
+        else:
+            yield b', '
+        yield orjson.dumps(file_path)
+    yield b']}'
+
+
 @app.route('/files')
 @api_login
 def list_files():
     """Get a directory listing of files in the current update."""
     path, _ = get_paths()
 
-    entries = []
-    for dirname, _, file_names in os.walk(path):
-        entries.extend([os.path.join(dirname, _f) for _f in file_names])
-
-    return make_response(jsonify({
-        'files': entries
-    }))
+    # Stream the JSON array so large update directories are never held
+    # in memory as one big list/serialized blob.
+    return Response(stream_with_context(_stream_file_listing(path)), mimetype='application/json')
 
 
 @app.route('/files/<path:name>')
@@ -82,7 +136,7 @@ def list_files():
 def get_file(name):
     """Download a specific file from the directory listing of the current update."""
     path, _ = get_paths()
-    return send_from_directory(path, name)
+    return send_from_directory(path, name, conditional=True)
 
 
 @app.route('/tar')
@@ -90,8 +144,16 @@ def get_file(name):
 def get_all_files():
     """Download a tar containing all the files in the current update."""
     _, path = get_paths()
-    return send_file(path)
+    return send_file(path, conditional=True, etag=True, last_modified=os.path.getmtime(path))
 
 
 if __name__ == '__main__':
-    app.run(ssl_context=ssl_context)
+    # Serve with gunicorn even when launched directly; the Werkzeug dev server is
+    # single-threaded and would serialize concurrent update downloads. Certs are
+    # surfaced through the environment so gunicorn_config can pick them up.
+    env = os.environ.copy()
+    if ssl_context:
+        env.setdefault('CERTFILE', ssl_context[0])
+        env.setdefault('KEYFILE', ssl_context[1])
+    os.execvpe('gunicorn', ['gunicorn', 'assemblyline_v4_service.updater.app:app',
+                            '--config=python:assemblyline_v4_service.updater.gunicorn_config'], env)
@@ -47,6 +47,7 @@ setup(
         'assemblyline-core',
         'cart',
         'fuzzywuzzy',
+        'orjson',
         'pefile',
         'pillow',
         'python-Levenshtein',